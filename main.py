@@ -1,6 +1,16 @@
 import os
+import re
+import sys
+import time
+import errno
 import shutil
 import fnmatch
+import logging
+import argparse
+from collections import Counter, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
 
 source_folder = "D:/compare/C"
 destination_folder = "D:/compare/D"
@@ -8,42 +18,399 @@ destination_folder = "D:/compare/D"
 # List of patterns for folders to exclude from copying
 excluded_folders = ["Books/Investavimas/kazkas", "Kazkas"]
 
-def should_exclude_folder(folder_path):
-    for pattern in excluded_folders:
-        if fnmatch.fnmatch(folder_path.lower(), f"*{pattern.lower()}*"):
-            return True
-    return False
-
-def copy_files(src, dest):
-    for root, dirs, files in os.walk(src, topdown=True):
-        if should_exclude_folder(root):
-            # Skip this folder and its contents
-            dirs.clear()
+# What plan_copies needs to know about a destination file. Much smaller
+# than keeping a whole os.stat_result per file in the index.
+FileInfo = namedtuple("FileInfo", "size mtime_ns")
+
+# Parallel copies. A few in flight hide per-file open/close latency; many
+# more make a single spinning backup disk seek between files. Raise it
+# with --workers for SSDs and network shares.
+max_workers = 4
+
+# A same-size source file counts as changed only when its mtime is more
+# than this many nanoseconds newer than the backup's. 0 compares exactly.
+# FAT (2 s) and some SMB destinations store coarser times than the source,
+# so they need a window (--modify-window) or every such file is recopied.
+modify_window_ns = 0
+
+# Seconds between progress lines while copies are running
+progress_interval = 5.0
+
+# Read size when checking whether a same-size file really changed
+compare_chunk_size = 1024 * 1024
+
+# copy_file_range errors meaning "not supported for these files", after
+# which the copy is redone the portable way
+copy_range_unsupported = {errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                          errno.EOPNOTSUPP, errno.EPERM}
+
+# Characters that make an exclusion pattern a glob rather than a plain name
+glob_chars = re.compile(r"[*?[]")
+
+def compile_exclusions(patterns):
+    # Fold all patterns into one case-insensitive regex so each folder is
+    # matched once in C. fnmatch semantics are kept: a pattern matches
+    # anywhere in the folder's path below the tree root, and normcase makes
+    # "/" and "\\" equivalent on Windows.
+    # Plain names become an escaped substring search; only real globs pay
+    # for fnmatch's leading ".*" backtracking.
+    if not patterns:
+        return None
+    parts = []
+    for pattern in patterns:
+        pattern = os.path.normcase(pattern)
+        if glob_chars.search(pattern):
+            parts.append(fnmatch.translate(f"*{pattern}*"))
+        else:
+            parts.append(re.escape(pattern))
+    return re.compile("|".join(parts), re.IGNORECASE)
+
+def should_exclude_folder(folder_path, excluded_re):
+    if excluded_re is None:
+        return False
+    return excluded_re.search(os.path.normcase(folder_path)) is not None
+
+def long_path(path):
+    # On Windows, give a tree root the \\?\ prefix so every path built from
+    # it bypasses the 260-character MAX_PATH limit and Win32's per-call
+    # path normalisation. Other platforms get the path unchanged.
+    if os.name != "nt":
+        return path
+    path = os.path.abspath(path)
+    if path.startswith(("\\\\?\\", "\\\\.\\")):
+        # Already a \\?\ or \\.\ (device namespace) path; a device path
+        # is not a UNC share and must not get the UNC prefix
+        return path
+    if path.startswith("\\\\"):
+        # UNC share: \\server\share becomes \\?\UNC\server\share
+        return "\\\\?\\UNC\\" + path[2:]
+    return "\\\\?\\" + path
+
+def scan_files(top, excluded_re=None):
+    # Yield a DirEntry for every file below top, skipping folders matched by
+    # excluded_re (from compile_exclusions). Folders are matched by their path
+    # relative to top, so folder names above the root never exclude anything,
+    # however the root was spelled. DirEntry caches the stat data it was
+    # listed with, so callers read mtime without another syscall per file
+    # (on Windows the directory listing already carries it).
+    prefix_len = len(os.path.join(top, ""))
+    # Bound once: these run for every entry in the tree
+    scandir = os.scandir
+    stack = [top]
+    push = stack.append
+    while stack:
+        folder = stack.pop()
+        try:
+            entries = scandir(folder)
+        except OSError as e:
+            # Unreadable folder; skip it like os.walk does, but say so: an
+            # unattended run would otherwise miss a subtree without a trace
+            logger.warning("Skipping unreadable folder %s: %s", folder, e)
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    # Prune excluded folders before listing them
+                    if not should_exclude_folder(entry.path[prefix_len:], excluded_re):
+                        push(entry.path)
+                elif entry.is_file():
+                    yield entry
+
+def index_files(top):
+    # Map the normcased path of every file below top, relative to top, to
+    # its FileInfo. One scandir pass replaces a stat call per lookup.
+    # Exclusions are not applied: only source files that passed them are
+    # ever looked up.
+    prefix_len = len(os.path.join(top, ""))
+    normcase = os.path.normcase
+    index = {}
+    if not os.path.isdir(top):
+        # First backup into a destination that doesn't exist yet
+        return index
+    for entry in scan_files(top):
+        try:
+            stat = entry.stat()
+            index[normcase(entry.path[prefix_len:])] = FileInfo(
+                stat.st_size, stat.st_mtime_ns)
+        except FileNotFoundError:
+            # Removed since it was listed
+            pass
+    return index
+
+def kernel_copy(src_path, dest_path):
+    # Copy the file contents inside the kernel. On copy-on-write filesystems
+    # (Btrfs, XFS) this clones extents instead of moving any data.
+    # Returns False when the filesystem can't do it.
+    with open(src_path, "rb") as fsrc, open(dest_path, "wb") as fdst:
+        src_fd, dest_fd = fsrc.fileno(), fdst.fileno()
+        remaining = os.fstat(src_fd).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(src_fd, dest_fd, remaining)
+                if not copied:
+                    # Some filesystems report EOF early; copy the portable way
+                    return False
+                remaining -= copied
+        except OSError as e:
+            if e.errno in copy_range_unsupported:
+                return False
+            raise
+    return True
+
+# On Windows, shutil.copy2 only hands the copy to the kernel (CopyFile2)
+# from Python 3.12; older versions copy through a userspace buffer, so
+# call CopyFileExW directly there
+if os.name == "nt" and sys.version_info < (3, 12):
+    import ctypes
+    from ctypes import wintypes
+
+    CopyFileExW = ctypes.WinDLL("kernel32", use_last_error=True).CopyFileExW
+    CopyFileExW.argtypes = (wintypes.LPCWSTR, wintypes.LPCWSTR, ctypes.c_void_p,
+                            ctypes.c_void_p, ctypes.c_void_p, wintypes.DWORD)
+    CopyFileExW.restype = wintypes.BOOL
+else:
+    CopyFileExW = None
+
+COPY_FILE_ALLOW_DECRYPTED_DESTINATION = 0x8
+ERROR_ACCESS_DENIED = 5
+
+def windows_copy(src_path, dest_path):
+    # Copy with CopyFileExW, which overwrites an existing destination.
+    # Returns False when Windows refuses the file, so copy2 can try it
+    # (Python 3.12 falls back the same way for CopyFile2).
+    if CopyFileExW(src_path, dest_path, None, None, None,
+                   COPY_FILE_ALLOW_DECRYPTED_DESTINATION):
+        return True
+    error = ctypes.get_last_error()
+    if error == ERROR_ACCESS_DENIED:
+        return False
+    raise ctypes.WinError(error)
+
+def fast_copy(src_path, dest_path):
+    # Same result as shutil.copy2, with the data copied in the kernel:
+    # copy_file_range where available, CopyFileExW on Windows before 3.12.
+    # Otherwise copy2 itself picks the native path (CopyFile2 on Windows
+    # 3.12+, fcopyfile on macOS, sendfile on Linux).
+    if hasattr(os, "copy_file_range"):
+        copied = kernel_copy(src_path, dest_path)
+    elif CopyFileExW is not None:
+        copied = windows_copy(src_path, dest_path)
+    else:
+        copied = False
+    if copied:
+        shutil.copystat(src_path, dest_path)
+    else:
+        shutil.copy2(src_path, dest_path)
+
+def plan_copies(src, dest, excluded_re=None, window_ns=modify_window_ns):
+    # Yield (source_path, destination_path, reason) for every file that
+    # needs copying, so the copy work is known before any of it starts.
+    # reason is "new", "modified", "touched" (newer but the same size, so
+    # possibly only the timestamp changed), or "timestamp" (newer but both
+    # empty, so certainly only the timestamp changed).
+    # Every scanned path starts with src plus a separator, so the relative
+    # path is a slice and the destination a concatenation; relpath/join
+    # per file would re-parse both paths each time.
+    src_prefix_len = len(os.path.join(src, ""))
+    dest_prefix = os.path.join(dest, "")
+    lookup = index_files(dest).get
+    normcase = os.path.normcase
+    for entry in scan_files(src, excluded_re):
+        source_path = entry.path
+        relative_path = source_path[src_prefix_len:]
+        destination_path = dest_prefix + relative_path
+
+        # Check if the file exists in the destination folder
+        dest_info = lookup(normcase(relative_path))
+        if dest_info is None:
+            # File doesn't exist in the destination, so copy it
+            yield source_path, destination_path, "new"
             continue
 
-        for file in files:
-            source_path = os.path.join(root, file)
-            relative_path = os.path.relpath(source_path, src)
-            destination_path = os.path.join(dest, relative_path)
-
-            # Ensure the destination directory exists, create it if not
-            destination_dir = os.path.dirname(destination_path)
-            if not os.path.exists(destination_dir):
-                os.makedirs(destination_dir)
-
-            # Check if the file exists in the destination folder
-            if not os.path.exists(destination_path):
-                # File doesn't exist in the destination, so copy it
-                print(f"Copying {source_path} to {destination_path}")
-                shutil.copy2(source_path, destination_path)
-            else:
-                # File exists; compare modification timestamps
-                source_mtime = os.path.getmtime(source_path)
-                dest_mtime = os.path.getmtime(destination_path)
-                if source_mtime > dest_mtime:
-                    # Source file is newer; copy it to update the destination file
-                    print(f"Copying {source_path} to {destination_path} (modified)")
-                    shutil.copy2(source_path, destination_path)
-
-# Example usage:
-copy_files(source_folder, destination_folder)
\ No newline at end of file
+        # File exists; compare size and modification timestamps. A size
+        # mismatch means the copy is stale whichever side is newer. Integer
+        # nanoseconds avoid float rounding between filesystems.
+        try:
+            source_stat = entry.stat()
+        except FileNotFoundError:
+            # Removed since it was listed (e.g. a temp file)
+            continue
+        if source_stat.st_size != dest_info.size:
+            # Source file changed; copy it to update the destination file
+            yield source_path, destination_path, "modified"
+        elif source_stat.st_mtime_ns > dest_info.mtime_ns + window_ns:
+            # Two empty files have nothing to compare
+            yield (source_path, destination_path,
+                   "timestamp" if dest_info.size == 0 else "touched")
+
+def make_dirs(path, created_dirs):
+    # Like os.makedirs(path, exist_ok=True), but tries mkdir first, so an
+    # existing parent costs one syscall instead of a stat before and after.
+    # Folders made or found are remembered in created_dirs.
+    if path in created_dirs:
+        return
+    try:
+        os.mkdir(path)
+    except FileNotFoundError:
+        parent = os.path.dirname(path)
+        if parent == path:
+            raise
+        make_dirs(parent, created_dirs)
+        os.mkdir(path)
+    except FileExistsError:
+        if not os.path.isdir(path):
+            raise
+    created_dirs.add(path)
+
+def same_content(path1, path2):
+    # Compare two files of equal size, stopping at the first differing chunk.
+    # Reading both is cheaper than rewriting the destination, and a direct
+    # comparison needs no hashing.
+    with open(path1, "rb") as f1, open(path2, "rb") as f2:
+        while True:
+            chunk = f1.read(compare_chunk_size)
+            if chunk != f2.read(compare_chunk_size):
+                return False
+            if not chunk:
+                return True
+
+def copy_one(source_path, destination_path, reason):
+    # Returns the reason actually applied, with "timestamp" reported as
+    # "touched" for the summary. Per-file lines are debug output:
+    # a console write per file costs more than copying a small file.
+    if reason == "timestamp" or (reason == "touched"
+                                 and same_content(source_path, destination_path)):
+        # Only the timestamp moved (e.g. the file was re-saved); carry it
+        # over so the next run skips the file
+        logger.debug("Updating timestamps of %s", destination_path)
+        shutil.copystat(source_path, destination_path)
+        return "touched"
+    if reason == "touched":
+        reason = "modified"
+
+    if reason == "modified":
+        logger.debug("Copying %s to %s (modified)", source_path, destination_path)
+    else:
+        logger.debug("Copying %s to %s", source_path, destination_path)
+    fast_copy(source_path, destination_path)
+    return reason
+
+def copy_files(src, dest, excluded=excluded_folders, workers=max_workers,
+               window_ns=modify_window_ns):
+    excluded_re = compile_exclusions(excluded)
+    # Destination folders already ensured this run; files in the same
+    # folder then cost no extra mkdir/stat calls
+    created_dirs = set()
+    counts = Counter()
+    next_report = time.monotonic() + progress_interval
+
+    def record(done):
+        # Count completions here in the main thread: no shared counter for
+        # the workers to update, and at most one progress line per interval.
+        # result() surfaces the first copy error.
+        nonlocal next_report
+        for future in done:
+            counts[future.result()] += 1
+        if time.monotonic() >= next_report:
+            logger.info("Processed %d files so far", sum(counts.values()))
+            next_report = time.monotonic() + progress_interval
+
+    # Keep only a couple of jobs per worker queued: planning waits for the
+    # copies instead of piling up a future for every file in the tree
+    max_pending = 2 * workers
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        jobs = plan_copies(long_path(src), long_path(dest), excluded_re,
+                           window_ns)
+        for source_path, destination_path, reason in jobs:
+            # Create folders here rather than in the workers so they never
+            # race on the same mkdir. Files already in the destination
+            # have their folder.
+            if reason == "new":
+                make_dirs(os.path.dirname(destination_path), created_dirs)
+
+            pending.add(executor.submit(copy_one, source_path,
+                                        destination_path, reason))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                record(done)
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            record(done)
+
+    logger.info("Copied %d files from %s to %s (%d modified, %d timestamp-only)",
+                counts["new"] + counts["modified"], src, dest,
+                counts["modified"], counts["touched"])
+
+def positive_int(value):
+    # argparse type for a count of at least 1
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a whole number: {value!r}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: {value!r}")
+    return number
+
+def exclusion_pattern(value):
+    # argparse type for --exclude. An empty pattern would match every path
+    # and silently exclude the whole source.
+    if not value:
+        raise argparse.ArgumentTypeError(
+            "empty pattern; use --no-exclude to turn exclusions off")
+    return value
+
+def seconds(value):
+    # argparse type for a non-negative duration
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a number: {value!r}")
+    if not 0 <= number < float("inf"):
+        raise argparse.ArgumentTypeError(f"must be a non-negative number: {value!r}")
+    return number
+
+def main(argv=None):
+    # Folders, exclusions and copy settings can come from the command line,
+    # so a sync runs unattended (e.g. from cron or Task Scheduler); defaults
+    # are the values above
+    parser = argparse.ArgumentParser(
+        description="Copy new and changed files from a source folder to a backup folder.")
+    parser.add_argument("source", nargs="?", default=source_folder,
+                        help=f"folder to back up (default: {source_folder})")
+    parser.add_argument("destination", nargs="?", default=destination_folder,
+                        help=f"backup folder (default: {destination_folder})")
+    exclusions = parser.add_mutually_exclusive_group()
+    exclusions.add_argument("-x", "--exclude", action="append", metavar="PATTERN",
+                            type=exclusion_pattern,
+                            help="skip folders whose path contains PATTERN (glob allowed); "
+                                 "repeat for several, replaces the built-in list")
+    exclusions.add_argument("--no-exclude", action="store_const", const=[],
+                            dest="exclude", help="copy every folder")
+    parser.add_argument("-j", "--workers", type=positive_int, default=max_workers,
+                        help=f"parallel copies (default: {max_workers})")
+    parser.add_argument("--modify-window", type=seconds, metavar="SECONDS",
+                        default=modify_window_ns / 1e9,
+                        help="treat modification times this close as equal; "
+                             "use 2 for FAT destinations "
+                             f"(default: {modify_window_ns / 1e9:g})")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="log every copied file")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.source):
+        # A typo or an unmounted drive would otherwise "back up" nothing and
+        # report success
+        parser.error(f"source folder not found: {args.source}")
+
+    # stdout, like the print calls this replaced, so redirected runs still
+    # capture the log
+    logging.basicConfig(stream=sys.stdout,
+                        level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(message)s")
+    excluded = excluded_folders if args.exclude is None else args.exclude
+    copy_files(args.source, args.destination, excluded, args.workers,
+               round(args.modify_window * 1_000_000_000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+import os
+import errno
+import tempfile
+import unittest
+from unittest import mock
+
+import main
+
+# A whole-second base time, so sub-second offsets below stay in the same second
+base_ns = 1_700_000_000 * 1_000_000_000
+
+def write(path, text, mtime_ns=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+class TempTreeTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        self.src = os.path.join(tmp.name, "src")
+        self.dest = os.path.join(tmp.name, "dest")
+        os.mkdir(self.src)
+        os.mkdir(self.dest)
+
+    def pair(self, name, source_text, source_ns, dest_text, dest_ns):
+        write(os.path.join(self.src, name), source_text, source_ns)
+        write(os.path.join(self.dest, name), dest_text, dest_ns)
+
+class PlanCopiesTest(TempTreeTest):
+    def plan(self, src=None, **kwargs):
+        src = src or self.src
+        return {os.path.relpath(source_path, src): reason
+                for source_path, _, reason in main.plan_copies(src, self.dest, **kwargs)}
+
+    def test_decisions(self):
+        write(os.path.join(self.src, "sub", "new.txt"), "new")
+        # Size differs: stale whichever side is newer
+        self.pair("grown.txt", "longer", base_ns, "short", base_ns + 10**9)
+        # Same size and newer: possibly only the timestamp moved
+        self.pair("touched.txt", "aaaa", base_ns + 10**9, "bbbb", base_ns)
+        self.pair("same.txt", "same", base_ns, "same", base_ns)
+        self.pair("older.txt", "aaaa", base_ns, "bbbb", base_ns + 10**9)
+        self.assertEqual(self.plan(), {
+            os.path.join("sub", "new.txt"): "new",
+            "grown.txt": "modified",
+            "touched.txt": "touched",
+        })
+
+    def test_same_second_edit_is_not_missed(self):
+        self.pair("db.bin", "new!", base_ns + 900_000_000, "old!", base_ns + 100_000_000)
+        self.assertEqual(self.plan(), {"db.bin": "touched"})
+
+    def test_modify_window(self):
+        # FAT stores 2 s times, so the backup can look up to 2 s older
+        self.pair("fat.txt", "same", base_ns + 1_999_999_999, "same", base_ns)
+        self.assertEqual(self.plan(window_ns=2 * 10**9), {})
+        self.pair("fat.txt", "same", base_ns + 2_000_000_001, "same", base_ns)
+        self.assertEqual(self.plan(window_ns=2 * 10**9), {"fat.txt": "touched"})
+
+    def test_empty_files_skip_the_comparison(self):
+        self.pair("empty.txt", "", base_ns + 10**9, "", base_ns)
+        self.assertEqual(self.plan(), {"empty.txt": "timestamp"})
+
+    def test_excluded_folders_are_skipped(self):
+        write(os.path.join(self.src, "Kazkas", "x.txt"), "x")
+        write(os.path.join(self.src, "keep", "y.txt"), "y")
+        excluded_re = main.compile_exclusions(["Kazkas"])
+        self.assertEqual(self.plan(excluded_re=excluded_re),
+                         {os.path.join("keep", "y.txt"): "new"})
+
+    def test_folders_above_the_root_never_exclude(self):
+        # Only the path below the root is matched, so neither a parent
+        # folder nor the root's own name excludes anything
+        excluded_re = main.compile_exclusions(["Kazkas"])
+        for src in (os.path.join(self.tmp, "Kazkas", "src"),
+                    os.path.join(self.tmp, "Kazkas")):
+            write(os.path.join(src, "sub", "a.txt"), "a")
+            self.assertIn(os.path.join("sub", "a.txt"),
+                          self.plan(src, excluded_re=excluded_re))
+
+    def test_unreadable_folders_are_logged(self):
+        write(os.path.join(self.src, "locked", "x.txt"), "x")
+        write(os.path.join(self.src, "open", "y.txt"), "y")
+        locked = os.path.join(self.src, "locked")
+        scandir = os.scandir
+
+        def refuse_locked(path):
+            if path == locked:
+                raise PermissionError(errno.EACCES, "Permission denied", path)
+            return scandir(path)
+
+        with mock.patch("os.scandir", refuse_locked), \
+                self.assertLogs(main.logger, "WARNING") as logs:
+            planned = self.plan()
+        self.assertEqual(planned, {os.path.join("open", "y.txt"): "new"})
+        self.assertIn(locked, logs.output[0])
+
+    def test_missing_destination_is_empty(self):
+        write(os.path.join(self.src, "a.txt"), "a")
+        os.rmdir(self.dest)
+        with self.assertNoLogs(main.logger, "WARNING"):
+            self.assertEqual(self.plan(), {"a.txt": "new"})
+
+class CopyOneTest(TempTreeTest):
+    def test_touched_with_same_content_only_gets_timestamps(self):
+        self.pair("t.txt", "same", base_ns + 10**9, "same", base_ns)
+        source_path = os.path.join(self.src, "t.txt")
+        destination_path = os.path.join(self.dest, "t.txt")
+        with mock.patch.object(main, "fast_copy") as fast_copy:
+            reason = main.copy_one(source_path, destination_path, "touched")
+        self.assertEqual(reason, "touched")
+        fast_copy.assert_not_called()
+        self.assertEqual(os.stat(destination_path).st_mtime_ns, base_ns + 10**9)
+
+    def test_touched_with_new_content_is_copied(self):
+        self.pair("t.txt", "new!", base_ns + 10**9, "old!", base_ns)
+        destination_path = os.path.join(self.dest, "t.txt")
+        reason = main.copy_one(os.path.join(self.src, "t.txt"), destination_path, "touched")
+        self.assertEqual(reason, "modified")
+        self.assertEqual(read(destination_path), "new!")
+
+    def test_empty_files_are_not_opened(self):
+        self.pair("e.txt", "", base_ns + 10**9, "", base_ns)
+        destination_path = os.path.join(self.dest, "e.txt")
+        with mock.patch.object(main, "same_content") as same_content:
+            reason = main.copy_one(os.path.join(self.src, "e.txt"), destination_path,
+                                   "timestamp")
+        self.assertEqual(reason, "touched")
+        same_content.assert_not_called()
+        self.assertEqual(os.stat(destination_path).st_mtime_ns, base_ns + 10**9)
+
+class CopyFilesTest(TempTreeTest):
+    def test_copies_new_and_changed_files(self):
+        # More files than the in-flight window of one worker holds
+        for i in range(10):
+            write(os.path.join(self.src, "a", "b", f"{i}.txt"), str(i))
+        self.pair("d.txt", "newer", base_ns, "old", base_ns)
+        main.copy_files(self.src, self.dest, excluded=[], workers=1)
+        for i in range(10):
+            self.assertEqual(read(os.path.join(self.dest, "a", "b", f"{i}.txt")), str(i))
+        self.assertEqual(read(os.path.join(self.dest, "d.txt")), "newer")
+
+    def test_copy_errors_propagate(self):
+        write(os.path.join(self.src, "a.txt"), "a")
+        with mock.patch.object(main, "fast_copy", side_effect=OSError(errno.ENOSPC, "full")):
+            with self.assertRaises(OSError):
+                main.copy_files(self.src, self.dest, excluded=[], workers=1)
+
+class MakeDirsTest(unittest.TestCase):
+    def test_creates_missing_parents_and_remembers_them(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "a", "b", "c")
+            created_dirs = set()
+            main.make_dirs(path, created_dirs)
+            self.assertTrue(os.path.isdir(path))
+            self.assertEqual(created_dirs, {os.path.join(tmp, "a"),
+                                            os.path.join(tmp, "a", "b"), path})
+            # Existing folders are fine
+            main.make_dirs(path, set())
+
+    def test_existing_file_in_the_way(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "file")
+            write(path, "x")
+            with self.assertRaises(FileExistsError):
+                main.make_dirs(path, set())
+
+class CompileExclusionsTest(unittest.TestCase):
+    def matches(self, patterns, path):
+        return main.compile_exclusions(patterns).search(os.path.normcase(path)) is not None
+
+    def test_no_patterns(self):
+        self.assertIsNone(main.compile_exclusions([]))
+
+    def test_plain_names_match_as_substrings(self):
+        self.assertTrue(self.matches(["Kazkas"], os.path.join("Books", "kazkas")))
+        self.assertTrue(self.matches(["Books/Investavimas"],
+                                     os.path.join("Books", "Investavimas", "x")))
+        self.assertFalse(self.matches(["Kazkas"], "Books"))
+
+    def test_plain_names_are_not_regexes(self):
+        self.assertTrue(self.matches(["a+b (1)"], "a+b (1)"))
+        self.assertFalse(self.matches(["a+b"], "aab"))
+
+    def test_globs(self):
+        self.assertTrue(self.matches(["tmp*"], os.path.join("x", "tmp123")))
+        self.assertTrue(self.matches(["cache?"], "cache1"))
+        self.assertFalse(self.matches(["cache?"], "cach"))
+
+class LongPathTest(unittest.TestCase):
+    def long_path(self, path):
+        import ntpath
+        with mock.patch.object(main.os, "name", "nt"), \
+                mock.patch.object(main.os, "path", ntpath):
+            return main.long_path(path)
+
+    def test_drive_paths(self):
+        self.assertEqual(self.long_path("D:\\compare\\C"), "\\\\?\\D:\\compare\\C")
+
+    def test_unc_shares(self):
+        self.assertEqual(self.long_path("\\\\server\\share\\C"),
+                         "\\\\?\\UNC\\server\\share\\C")
+
+    def test_namespace_paths_are_kept(self):
+        for path in ("\\\\?\\D:\\compare\\C", "\\\\.\\D:\\compare\\C"):
+            self.assertEqual(self.long_path(path), path)
+
+    def test_other_platforms_unchanged(self):
+        with mock.patch.object(main.os, "name", "posix"):
+            self.assertEqual(main.long_path("some/dir"), "some/dir")
+
+class FastCopyTest(TempTreeTest):
+    def setUp(self):
+        super().setUp()
+        self.source_path = os.path.join(self.src, "f.bin")
+        self.destination_path = os.path.join(self.dest, "f.bin")
+        write(self.source_path, "data" * 1000, base_ns)
+
+    def assert_copied(self):
+        self.assertEqual(read(self.destination_path), "data" * 1000)
+        self.assertEqual(os.stat(self.destination_path).st_mtime_ns, base_ns)
+
+    def test_copy(self):
+        main.fast_copy(self.source_path, self.destination_path)
+        self.assert_copied()
+
+    @unittest.skipUnless(hasattr(os, "copy_file_range"), "needs os.copy_file_range")
+    def test_falls_back_when_unsupported(self):
+        error = OSError(errno.EXDEV, "cross-device")
+        with mock.patch("os.copy_file_range", side_effect=error):
+            main.fast_copy(self.source_path, self.destination_path)
+        self.assert_copied()
+
+    @unittest.skipUnless(hasattr(os, "copy_file_range"), "needs os.copy_file_range")
+    def test_falls_back_on_early_eof(self):
+        with mock.patch("os.copy_file_range", return_value=0):
+            self.assertFalse(main.kernel_copy(self.source_path, self.destination_path))
+            main.fast_copy(self.source_path, self.destination_path)
+        self.assert_copied()
+
+    @unittest.skipUnless(hasattr(os, "copy_file_range"), "needs os.copy_file_range")
+    def test_other_errors_propagate(self):
+        with mock.patch("os.copy_file_range", side_effect=OSError(errno.EIO, "I/O error")):
+            with self.assertRaises(OSError):
+                main.fast_copy(self.source_path, self.destination_path)
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.src = tmp.name
+        self.dest = os.path.join(tmp.name, "backup")
+        patcher = mock.patch.object(main, "copy_files")
+        self.copy_files = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_main(self, *options):
+        main.main([self.src, self.dest, *options])
+        (src, dest, excluded, workers, window_ns), _ = self.copy_files.call_args
+        self.assertEqual((src, dest), (self.src, self.dest))
+        return excluded, workers, window_ns
+
+    def assert_usage_error(self, *argv):
+        with mock.patch("sys.stderr"), self.assertRaises(SystemExit) as raised:
+            main.main(list(argv))
+        self.assertEqual(raised.exception.code, 2)
+        self.copy_files.assert_not_called()
+
+    def test_defaults(self):
+        self.assertEqual(self.run_main(),
+                         (main.excluded_folders, main.max_workers, main.modify_window_ns))
+
+    def test_exclusions(self):
+        self.assertEqual(self.run_main("-x", "a", "-x", "b*")[0], ["a", "b*"])
+        self.assertEqual(self.run_main("--no-exclude")[0], [])
+
+    def test_workers_and_modify_window(self):
+        self.assertEqual(self.run_main("-j", "2", "--modify-window", "2")[1:],
+                         (2, 2_000_000_000))
+        self.assertEqual(self.run_main("--modify-window", "0.5")[2], 500_000_000)
+
+    def test_usage_errors(self):
+        for options in (["-j", "0"], ["-j", "-1"], ["-j", "x"], ["-x", ""],
+                        ["--no-exclude", "-x", "a"], ["--modify-window", "-1"],
+                        ["--modify-window", "inf"]):
+            with self.subTest(options=options):
+                self.assert_usage_error(self.src, self.dest, *options)
+
+    def test_missing_source(self):
+        self.assert_usage_error(os.path.join(self.src, "missing"), self.dest)
+
+if __name__ == "__main__":
+    unittest.main()